@@ -0,0 +1,28 @@
+"""
+numba helpers, kept out of `wrapper` since numba can only compile
+functions that have python bytecode, which is not the case for the
+closures of a Cython compiled `wrapper`.
+"""
+
+from functools import lru_cache
+
+
+# Compiled reduction loops of fold_njit(), keyed by the python kernel.
+# Bounded, as the loop holds the kernel strongly and per-call lambdas
+# would otherwise never be freed.
+@lru_cache(maxsize=32)
+def njit_fold(c):
+    """
+    Return a numba compiled `loop(arr, acc)` folding `arr` with kernel `c`.
+    """
+    import numba
+
+    kernel = numba.njit(c)
+
+    @numba.njit
+    def loop(arr, acc):
+        for i in range(arr.size):
+            acc = kernel(acc, arr[i])
+        return acc
+
+    return loop
@@ -1,21 +1,18 @@
-
+import sys as _sys
+from itertools import chain as _chain, count as _count, repeat as _repeat
 from typing import Iterable
 
 
 def range_inf(start, step):
-    while True:
-        yield start
-        start += step
+    return _count(start, step)
 
 
 def tail_inf(i: Iterable, d=None):
-    yield from i
-    while True:
-        yield d
+    return _chain(i, _repeat(d))
 
 
 def all_eq(i: Iterable, n) -> bool:
-    for a in i:
-        if a != n:
-            return False
-    return True
+    np = _sys.modules.get('numpy')
+    if np is not None and isinstance(i, np.ndarray):
+        return bool(np.all(i == n))
+    return all(a == n for a in i)
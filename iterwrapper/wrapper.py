@@ -1,6 +1,143 @@
+import sys as _sys
+import warnings as _warnings
+from collections import deque as _deque
 from collections.abc import Iterable as _Iterable
 from collections.abc import Callable as _Callable
+from collections.abc import Iterator as _Iterator
+from collections.abc import Mapping as _Mapping
+from collections.abc import Sized as _Sized
+from itertools import chain as _chain, islice, repeat as _repeat, tee as _tee
+from operator import index as _index, length_hint as _length_hint
 from iterwrapper.misc import all_eq, tail_inf
+from iterwrapper._jit import njit_fold as _njit_fold
+
+# Types that are never iterable, checked by exact type before falling
+# back to the iter() probe in flat().
+_SCALAR_TYPES = frozenset((int, float, complex, bool, type(None)))
+
+# Types that yield the same items every time they are iterated.
+_REITERABLE_TYPES = (list, tuple, range, str, bytes)
+
+# Opcodes for the plan queued by the lazy combinators, see `_compile()`.
+_MAP, _FILTER, _SKIP, _STEP, _TAKE = range(5)
+
+
+def _count(n, name):
+    """
+    Check the count given to skip/step/take, and return it as an int.
+    """
+    try:
+        return _index(n)
+    except TypeError:
+        if isinstance(n, float) and n.is_integer():
+            return int(n)
+        raise TypeError(
+            "{}() expects an integer, not {!r}".format(name, n)) from None
+
+
+def _compile(it, ops):
+    """
+    Build one iterator over `it` that runs the queued ops in order.
+
+    map and filter are stacked as the built-in iterators, while each run of
+    consecutive skip/step/take is folded into a single `islice()`, so that
+    a chain like `.skip(a).step(b).take(c)` is one C-level iterator.
+    """
+    window = None
+    for op, arg in ops:
+        if op == _MAP or op == _FILTER:
+            if window is not None:
+                it = islice(it, *window)
+                window = None
+            it = map(arg, it) if op == _MAP else filter(arg, it)
+            continue
+
+        start, stop, step = window or (0, None, 1)
+        if op == _SKIP:
+            start += arg * step
+        elif op == _STEP:
+            step *= arg
+        else:
+            end = start + (arg - 1) * step + 1 if arg > 0 else start
+            stop = end if stop is None else min(stop, end)
+        if stop is not None:
+            start = min(start, stop)
+        window = (start, stop, step)
+
+    if window is not None:
+        it = islice(it, *window)
+    return it
+
+
+# Below this size numpy's per-call overhead outweighs vectorizing.
+_VECTORIZE_MIN_SIZE = 64
+
+
+def _vectorizable(it, f):
+    """
+    Check if `f` can be applied to the whole of `it` at once, which is the
+    case for single-output unary numpy ufuncs over a large enough 1-D array.
+    """
+    np = _sys.modules.get('numpy')
+    return (
+        np is not None
+        and isinstance(f, np.ufunc) and f.nin == 1 and f.nout == 1
+        and isinstance(it, np.ndarray) and it.ndim == 1
+        and it.size > _VECTORIZE_MIN_SIZE
+    )
+
+
+def _sized(it):
+    """
+    Check if len(it) can be taken without consuming `it`. IterWrapper always
+    defines __len__, so a wrapped wrapper is asked about its own iterable.
+    """
+    if isinstance(it, IterWrapper):
+        return not it._ops and _sized(it._iterable)
+    return isinstance(it, _Sized)
+
+
+class _Replay:
+    """
+    Lazily buffer an iterable so that it can be iterated more than once,
+    every iteration starts from the first item.
+    """
+
+    def __init__(self, it):
+        # tee copies share one buffer, and start from where the copied
+        # tee is, which is never advanced
+        self._tee, = _tee(it, 1)
+
+    def __iter__(self):
+        return self._tee.__copy__()
+
+
+def _outer_stacklevel():
+    """
+    Return the stacklevel for a warnings.warn() called in this module that
+    points at the first caller outside of it. The frames are counted
+    instead of hardcoded, since a Cython compiled module pushes none.
+    """
+    level = 0
+    f = _sys._getframe(0)
+    while f is not None and f.f_code.co_filename == __file__:
+        f = f.f_back
+        level += 1
+    # the frame of this function is not on the stack of warn()
+    return max(level, 1)
+
+
+def _warn_consumed(w, name):
+    """
+    Warn if an iterator was directly given to the wrapper `w`, since `name`
+    would partially consume it. Wrappers made by the combinators are left
+    alone, they are usually throwaway pipelines.
+    """
+    if w._oneshot:
+        _warnings.warn(
+            "{}() consumes the one-shot iterator wrapped by IterWrapper, "
+            "call materialize() or cached() first to keep it".format(name),
+            stacklevel=_outer_stacklevel())
 
 
 class IterWrapper:
@@ -107,53 +244,109 @@ class IterWrapper:
 
     """
 
-    def __init__(self, it):
+    def __init__(self, it, ops=()):
         super().__init__()
-        if not isinstance(it, _Iterable):
+        # the same test Iterable.__subclasshook__ does, without the ABC machinery
+        if getattr(it, '__iter__', None) is None:
             raise TypeError
 
-        self.__iterable__ = it
+        self._iterable = it
+        # map/filter/skip/step/take are queued here instead of wrapping
+        # the iterable once per call, and compiled on first use.
+        self._ops = ops
+        # set when the user wrapped an iterator, see contains()
+        self._oneshot = isinstance(it, _Iterator)
+
+    @classmethod
+    def _wrap(cls, it, ops=()):
+        """
+        Wrap `it` without checking it, for iterables made by the wrapper itself.
+        """
+        self = cls.__new__(cls)
+        self._iterable = it
+        self._ops = ops
+        self._oneshot = False
+        return self
 
     def __iter__(self):
-        return self.__iterable__.__iter__()
+        if self._ops:
+            return iter(self.unwrap())
+        return iter(self._iterable)
 
     def __len__(self):
-        return self.count()
-
-    def __getattribute__(self, attr):
-        try:
-            return super().__getattribute__(attr)
-        except AttributeError:
-            att = self.__iterable__.__getattribute__(attr)
-            if isinstance(att, _Iterable):
-                return IterWrapper(att)
-            elif isinstance(att, _Callable):
-                def closure(*args, **kwargs):
-                    ret = att(*args, **kwargs)
-                    if isinstance(ret, _Iterable):
-                        return IterWrapper(ret)
-                    else:
-                        return ret
-                return closure
-            return att
+        # list() and friends call len() before iterating, so this must never
+        # consume the iterable, use count() for that.
+        if self._ops or not _sized(self._iterable):
+            raise TypeError(
+                "IterWrapper over a lazy iterable has no len(), use count()")
+        return len(self._iterable)
+
+    def __bool__(self):
+        # Without this, truth testing falls back to __len__ and raises for
+        # lazy wrappers. Like any iterator, a lazy wrapper is always true,
+        # as telling if it is empty would consume it.
+        if self._ops or not _sized(self._iterable):
+            return True
+        return len(self._iterable) > 0
+
+    def __length_hint__(self):
+        hint = _length_hint(self._iterable, 0)
+        for op, arg in self._ops:
+            if op == _SKIP:
+                hint = max(hint - arg, 0)
+            elif op == _STEP:
+                hint = -(-hint // arg)
+            elif op == _TAKE:
+                hint = min(hint, max(arg, 0))
+        return hint
+
+    def __getattr__(self, attr):
+        # Only reached when normal lookup fails, so the wrapper's own
+        # attributes and methods are resolved without going through here.
+        if attr in ('_iterable', '_ops', '_oneshot'):
+            raise AttributeError(attr)
+        att = getattr(self.unwrap(), attr)
+        if isinstance(att, _Iterable):
+            return IterWrapper(att)
+        elif isinstance(att, _Callable):
+            def closure(*args, **kwargs):
+                ret = att(*args, **kwargs)
+                if isinstance(ret, _Iterable):
+                    return IterWrapper(ret)
+                else:
+                    return ret
+            return closure
+        return att
 
     def __getitem__(self, index):
+        it = self.unwrap()
+        sliceable = hasattr(it, '__getitem__') and not isinstance(it, _Mapping)
+
         if isinstance(index, slice):
+            if sliceable:
+                try:
+                    return IterWrapper(it[index])
+                except TypeError:
+                    # indexable but not sliceable, like deque
+                    pass
+            start, stop, step = index.start, index.stop, index.step
+            if ((start is not None and start < 0)
+                    or (stop is not None and stop < 0)
+                    or (step is not None and step < 1)):
+                raise ValueError("Unsupported slicing conversion for iterable")
+            return self.skip(start).step(step).take(stop)
+
+        if hasattr(it, '__getitem__'):
             try:
-                return IterWrapper(self.__iterable__[index])
-            except:
-                if index.start < 0 or index.step < 1 or index.stop < 0:
-                    raise ValueError(
-                        "Unsupported slicing conversion for iterable")
-                return self.skip(index.start).step(index.step).take(index.stop)
-        else:
-            try:
-                return self.__iterable__[index]
-            except:
-                if type(index) is int:
-                    return self.skip(index).take(1).collect(list)[0]
-                else:
-                    raise IndexError("Unsupported indexing for iterable")
+                return it[index]
+            except (KeyError, IndexError):
+                if sliceable:
+                    raise
+        if type(index) is int and index >= 0:
+            for i in islice(self, index, index + 1):
+                return i
+            raise IndexError("IterWrapper index out of range")
+        raise IndexError("Unsupported indexing for iterable")
 
     def __add__(self, other):
         return self.chain(other)
@@ -179,7 +372,7 @@ class IterWrapper:
     def __eq__(self, o: object) -> bool:
         class Exhausted():
             pass
-        for a, b in zip(tail_inf(self.__iterable__, Exhausted), tail_inf(o, Exhausted)):
+        for a, b in zip(tail_inf(self, Exhausted), tail_inf(o, Exhausted)):
             if a != b:
                 return False
             elif a == Exhausted and b == Exhausted:
@@ -189,6 +382,9 @@ class IterWrapper:
         """
         Map the iterator by f(i). a wrapped version of the built-in method map().
 
+        If a large 1-D numpy array is wrapped and f is a unary ufunc like
+        `np.sqrt`, f is applied to the whole array at once instead.
+
         Parameters
         ----------
         f : callable that use to map the values
@@ -201,7 +397,9 @@ class IterWrapper:
         ```
         """
 
-        return IterWrapper(map(f, self.__iterable__))
+        if not self._ops and _vectorizable(self._iterable, f):
+            return IterWrapper._wrap(f(self._iterable))
+        return IterWrapper._wrap(self._iterable, self._ops + ((_MAP, f),))
 
     def foreach(self, f):
         """
@@ -223,16 +421,19 @@ class IterWrapper:
         """
 
         def closure():
-            for i in self.__iterable__:
+            for i in self:
                 f(i)
                 yield i
 
-        return IterWrapper(closure())
+        return IterWrapper._wrap(closure())
 
     def filter(self, f):
         """
         Filter the iterator by f(i). a wrapped version of the built-in method filter()
 
+        If a large 1-D numpy array is wrapped and f is a unary ufunc like
+        `np.isfinite`, the array is masked by f(array) at once instead.
+
         Parameters
         ----------
         f : callable the use to filter the values
@@ -244,29 +445,47 @@ class IterWrapper:
         [0, 2, 4, 6, 8]
         ```
         """
-        return IterWrapper(filter(f, self.__iterable__))
+        if not self._ops and _vectorizable(self._iterable, f):
+            it = self._iterable
+            return IterWrapper._wrap(it[f(it).astype(bool, copy=False)])
+        return IterWrapper._wrap(self._iterable, self._ops + ((_FILTER, f),))
 
-    def flat(self):
+    def flat(self, check=True):
         """
         Flatten the iterator by 1 depth.
 
+        Parameters
+        ----------
+        check : if False, every item is assumed to be iterable and the
+        flattening is done by `itertools.chain.from_iterable()`, which is
+        faster but raises TypeError on non-iterable items.
+
         Examples
         --------
         ```python
         >>> IterWrapper(range(0,10)).map(lambda x : (x, x+1)).flat().collect(list)
         [0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 7, 8, 8, 9, 9, 10, 10, 11]
+        >>> IterWrapper([[1, 2], [3]]).flat(check=False).collect(list)
+        [1, 2, 3]
         ```
         """
 
+        if not check:
+            return IterWrapper._wrap(_chain.from_iterable(self))
+
         def closure():
-            for i in self.__iterable__:
-                if isinstance(i, _Iterable):
-                    for j in i:
-                        yield j
-                else:
+            for i in self:
+                if type(i) in _SCALAR_TYPES:
                     yield i
+                    continue
+                try:
+                    it = iter(i)
+                except TypeError:
+                    yield i
+                    continue
+                yield from it
 
-        return IterWrapper(closure())
+        return IterWrapper._wrap(closure())
 
     def take(self, c):
         """
@@ -286,14 +505,11 @@ class IterWrapper:
 
         if c is None:
             return self
+        c = _count(c, 'take')
+        if c <= 0:
+            return IterWrapper._wrap(())
 
-        def closure():
-            for idx, i in enumerate(self.__iterable__):
-                if idx + 1 > c:
-                    break
-                yield i
-
-        return IterWrapper(closure())
+        return IterWrapper._wrap(self._iterable, self._ops + ((_TAKE, c),))
 
     def resize(self, c, d=None):
         """
@@ -316,12 +532,12 @@ class IterWrapper:
         """
         def closure():
             i = 0
-            it = (self.__iterable__ + IterWrapper([d]).inf()).__iter__()
+            it = iter(self + IterWrapper([d]).inf())
 
             while i < c:
                 yield next(it)
                 i += 1
-        return IterWrapper(closure())
+        return IterWrapper._wrap(closure())
 
     def skip(self, c):
         """
@@ -340,13 +556,13 @@ class IterWrapper:
         """
         if c is None:
             return self
+        c = _count(c, 'skip')
+        if c < 0:
+            raise ValueError("skip() expects a count >= 0, not {}".format(c))
+        if c == 0:
+            return self
 
-        def closure():
-            for idx, i in enumerate(self.__iterable__):
-                if idx >= c:
-                    yield i
-
-        return IterWrapper(closure())
+        return IterWrapper._wrap(self._iterable, self._ops + ((_SKIP, c),))
 
     def step(self, s):
         """
@@ -365,13 +581,13 @@ class IterWrapper:
         """
         if s is None:
             return self
+        s = _count(s, 'step')
+        if s < 1:
+            raise ValueError("step() expects a step >= 1, not {}".format(s))
+        if s == 1:
+            return self
 
-        def closure():
-            for idx, i in enumerate(self.__iterable__):
-                if idx % s == 0:
-                    yield i
-
-        return IterWrapper(closure())
+        return IterWrapper._wrap(self._iterable, self._ops + ((_STEP, s),))
 
     def mutate(self, t, *args, **kwargs):
         """
@@ -402,7 +618,7 @@ class IterWrapper:
         ```
         """
 
-        return IterWrapper(t(self.__iterable__, *args, **kwargs))
+        return IterWrapper(t(self.unwrap(), *args, **kwargs))
 
     def chain(self, it, before=False):
         """
@@ -422,20 +638,17 @@ class IterWrapper:
         ```
         """
 
-        def closure():
-            if before:
-                yield from it
-                yield from self.__iterable__
-            else:
-                yield from self.__iterable__
-                yield from it
-
-        return IterWrapper(closure())
+        if _sized(it) and len(it) == 0:
+            return self
+        return IterWrapper._wrap(_chain(it, self) if before else _chain(self, it))
 
     def repeat(self, t):
         """
-        Repeat the wrapped iterator for given times, notice that it is
-        exhaustive, since some iterable can only be yield for 1 time.
+        Repeat the wrapped iterator for given times.
+
+        Sequences are repeated as they are, anything else is cached into a
+        list while its first round is yielded, since some iterable can only
+        be yield for 1 time.
 
         Parameters
         ----------
@@ -449,11 +662,22 @@ class IterWrapper:
         ```
         """
 
+        if t == 1:
+            return self
+        if t <= 0:
+            return IterWrapper._wrap(())
+        if not self._ops and isinstance(self._iterable, _REITERABLE_TYPES):
+            return IterWrapper._wrap(_chain.from_iterable(_repeat(self._iterable, t)))
+
         def closure():
-            for _ in range(t):
-                yield from self.__iterable__
+            # like itertools.cycle, cache the first round while yielding it
+            cache = []
+            for i in self:
+                cache.append(i)
+                yield i
+            yield from _chain.from_iterable(_repeat(cache, t - 1))
 
-        return IterWrapper(closure())
+        return IterWrapper._wrap(closure())
 
     def chunk(self, n, t=tuple, d=None):
         """
@@ -474,7 +698,7 @@ class IterWrapper:
         """
 
         def closure():
-            it = self.__iterable__.__iter__()
+            it = iter(self)
             remained = True
             while remained:
                 r = []
@@ -488,11 +712,11 @@ class IterWrapper:
                     remained = False
                 yield t(r)
 
-        return IterWrapper(closure())
+        return IterWrapper._wrap(closure())
 
     def window(self, n, t=tuple):
         def closure():
-            it = self.__iterable__.__iter__()
+            it = iter(self)
             r = []
             try:
                 r = [next(it) for x in range(n)]
@@ -505,7 +729,7 @@ class IterWrapper:
 
             except StopIteration:
                 pass
-        return IterWrapper(closure())
+        return IterWrapper._wrap(closure())
 
     def zip(self, *it):
         """
@@ -514,7 +738,7 @@ class IterWrapper:
         A convinient wrapper of built-in function zip().
         """
 
-        return IterWrapper(zip(self.__iterable__, *it))
+        return IterWrapper._wrap(zip(self.unwrap(), *it))
 
     def lzip(self, *it, default=None):
         """
@@ -534,7 +758,7 @@ class IterWrapper:
                 else:
                     yield tuple(x if x != Exhausted else default for x in i)
 
-        return IterWrapper(closure(*it))
+        return IterWrapper._wrap(closure(*it))
 
     def inf(self):
         """
@@ -564,18 +788,18 @@ class IterWrapper:
         """
 
         def closure():
-            it = self.__iterable__.__iter__()
+            it = iter(self)
             while True:
                 try:
                     yield next(it)
                 except StopIteration:
-                    it = self.__iterable__.__iter__()
+                    it = iter(self)
                     try:
                         yield next(it)
                     except StopIteration:
                         break
 
-        return IterWrapper(closure())
+        return IterWrapper._wrap(closure())
 
     def fold(self, c, d=None):
         """
@@ -597,13 +821,49 @@ class IterWrapper:
         ```
         """
         r = d
-        for i in self.__iterable__:
+        for i in self:
             if r is None:
                 r = i
                 continue
             r = c(r, i)
         return r
 
+    def fold_njit(self, c, d=0.0):
+        """
+        Same as IterWrapper.fold(), but the reduction is compiled by numba
+        and run as a single native loop over a 1-D numpy array.
+
+        Only usable when the wrapped iterable is a 1-D numpy array with
+        nothing queued on it, and `c` can be compiled by `numba.njit`.
+        The first call for each `c` pays the compilation (usually some
+        hundreds of milliseconds), later calls reuse the compiled loop.
+        Pass a function defined once rather than a fresh lambda per call,
+        or it will be compiled again every time.
+
+        Parameters
+        ----------
+        c : the increment method
+
+        d : the starting value of the variable, unlike fold() it can not be
+        None, defaulting to 0.0
+
+        Examples
+        --------
+        ```python
+        >>> IterWrapper(np.arange(1, 11)).fold_njit(lambda c, x : c+x**2, 0)
+        385
+        ```
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("fold_njit() requires numpy and numba") from None
+
+        it = self._iterable
+        if self._ops or not isinstance(it, np.ndarray) or it.ndim != 1:
+            raise TypeError("fold_njit() requires a plain 1-D numpy array")
+        return _njit_fold(c)(it, d)
+
     def unwrap(self):
         """
         Unwraps the iterable inside the wrapper.
@@ -615,7 +875,47 @@ class IterWrapper:
         [0, 1]
         ```
         """
-        return self.__iterable__
+        if self._ops:
+            self._iterable = _compile(self._iterable, self._ops)
+            self._ops = ()
+        return self._iterable
+
+    def materialize(self):
+        """
+        Run everything queued on the wrapper and store the items in a list,
+        so that the wrapper can be consumed more than once. This method is
+        exhaustive, a wrapped container that is already re-iterable, like a
+        dict or a set, is kept as it is.
+
+        Examples
+        --------
+        ```python
+        >>> i = IterWrapper(x for x in range(3)).map(str).materialize()
+        >>> i.count(), i.collect(''.join)
+        (3, '012')
+        ```
+        """
+        if self._ops or isinstance(self._iterable, _Iterator):
+            self._iterable = list(self)
+            self._ops = ()
+            self._oneshot = False
+        return self
+
+    def cached(self):
+        """
+        Return a wrapper that can be consumed more than once, like
+        IterWrapper.materialize(), but stays lazy: items are buffered
+        the first time they are yielded.
+
+        Examples
+        --------
+        ```python
+        >>> i = IterWrapper(x for x in range(3)).cached()
+        >>> i.take(2).collect(list), i.collect(list)
+        ([0, 1], [0, 1, 2])
+        ```
+        """
+        return IterWrapper._wrap(_Replay(self))
 
     def collect(self, t):
         """
@@ -638,7 +938,10 @@ class IterWrapper:
         [None, None]
         ```
         """
-        return t(self.__iterable__)
+        if self._ops and (t is list or t is tuple):
+            # feed the wrapper itself so that the size can be hinted
+            return t(self)
+        return t(self.unwrap())
 
     def pipe(self, f):
         """
@@ -660,7 +963,7 @@ class IterWrapper:
         1
         ```
         """
-        for i in self.__iterable__:
+        for i in self:
             f(i)
 
     def apply(self, m, *args, **kwargs):
@@ -700,10 +1003,11 @@ class IterWrapper:
 
         """
 
-        if hasattr(m, '__objclass__') and not isinstance(self.__iterable__, m.__objclass__):
-            self.__iterable__ = m.__objclass__(self.__iterable__)
+        it = self.unwrap()
+        if hasattr(m, '__objclass__') and not isinstance(it, m.__objclass__):
+            self._iterable = it = m.__objclass__(it)
 
-        m(self.__iterable__, *args, **kwargs)
+        m(it, *args, **kwargs)
         return self
 
     def exhaust(self):
@@ -724,12 +1028,15 @@ class IterWrapper:
         2   
         ```
         """
-        for _ in self.__iterable__:
-            pass
+        _deque(self, maxlen=0)
 
     def count(self, f=None):
         """
-        Count the items in the iterable (by condition), this method is exhaustive.
+        Count the items in the iterable (by condition), this method is exhaustive,
+        unless no condition is given and the plain iterable knows its own size.
+
+        A wrapped one-shot iterator is used up by counting, see
+        IterWrapper.materialize().
 
         Parameters
         ----------
@@ -745,19 +1052,22 @@ class IterWrapper:
         ```
         """
         if f is None:
-            return len(self.collect(list))
+            if not self._ops and _sized(self._iterable):
+                return len(self._iterable)
+            return sum(1 for _ in self)
         else:
-            c = 0
-            for i in self:
-                if f(i):
-                    c += 1
-            return c
+            return sum(1 for i in self if f(i))
 
     def contains(self, item):
         """
         Check if given item is in the iterable, this method is exhaustive
         if iterable is not able to foresee a item is in its range.
 
+        The lookup is delegated to the `in` operator of the wrapped iterable,
+        so sets, dicts and ranges answer it directly. An iterator given
+        directly to IterWrapper() loses the items consumed by the search,
+        and a warning is emitted, see IterWrapper.materialize().
+
         Parameters
         ----------
         item : the item to check
@@ -771,19 +1081,21 @@ class IterWrapper:
         False
         ```
         """
+        _warn_consumed(self, 'contains')
+        it = self.unwrap()
         try:
-            return item in self.__iterable__
-        except Exception:
-            for i in self.__iterable__:
-                if i == item:
-                    return True
-            return False
+            return item in it
+        except TypeError:
+            # hashed containers refuse unhashable items, so compare instead
+            return any(i == item for i in it)
 
     def rev(self):
         """
         Reverse the iterable inside the wrapper, and will
         always return a list if the iterator is not sliceable.
 
+        A wrapped one-shot iterator is used up by reversing.
+
         Examples
         -------
         ```python
@@ -791,7 +1103,8 @@ class IterWrapper:
         [9, 8, 7, 6, 5, 4, 3, 2, 1, 0]
         ```
         """
+        it = self.unwrap()
         try:
-            return IterWrapper(self.__iterable__[::-1])
+            return IterWrapper(it[::-1])
         except:
             return self.mutate(list)[::-1]
@@ -1,5 +1,18 @@
+import os
 import setuptools
 
+# Compiling the wrapper with Cython is opt-in, set ITERWRAPPER_CYTHON=1 at
+# build time. A failed C compile of the optional extension still falls
+# back to the pure python module.
+ext_modules = []
+if os.environ.get("ITERWRAPPER_CYTHON") == "1":
+    from Cython.Build import cythonize
+    ext_modules = cythonize(
+        [setuptools.Extension(
+            "iterwrapper.wrapper", ["iterwrapper/wrapper.py"], optional=True)],
+        language_level=3,
+    )
+
 setuptools.setup(
     name="iterwrapper",
     version="0.1.4",
@@ -10,6 +23,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/Prunoideae/IterWrapper",
     packages=setuptools.find_packages(),
+    ext_modules=ext_modules,
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
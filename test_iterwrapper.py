@@ -1,4 +1,7 @@
+import itertools
+from collections import deque
 import pytest
+import warnings
 from iterwrapper import IterWrapper as iw
 import iterwrapper
 
@@ -13,6 +16,23 @@ def test_filter():
             ) == [0, 2]
 
 
+def test_vectorized():
+    np = pytest.importorskip("numpy")
+    arr = np.arange(-100, 100, dtype=float)
+
+    mapped = iw(arr).map(np.negative).unwrap()
+    assert isinstance(mapped, np.ndarray)
+    assert mapped.tolist() == [-x for x in arr.tolist()]
+
+    filtered = iw(arr).filter(np.signbit).unwrap()
+    assert isinstance(filtered, np.ndarray)
+    assert filtered.tolist() == [x for x in arr.tolist() if x < 0]
+
+    # multi-output ufuncs keep the per-item path
+    assert iw(arr).map(np.modf).collect(list)[0] == np.modf(arr[0])
+    assert len(iw(arr).filter(np.modf).collect(list)) == len(arr)
+
+
 def test_foreach():
     assert (
         iw([[1, 2, 3], [1, 2], [1]])
@@ -28,6 +48,18 @@ def test_flat():
         .collect(list)
     ) == [1, 2, 2, 3, 3, 4]
 
+    assert (
+        iw([1, (2, 3), None, 'ab'])
+        .flat()
+        .collect(list)
+    ) == [1, 2, 3, None, 'a', 'b']
+
+    assert (
+        iw([[1, 2], [2, 3], [3, 4]])
+        .flat(check=False)
+        .collect(list)
+    ) == [1, 2, 2, 3, 3, 4]
+
 
 def test_take():
     assert (
@@ -53,6 +85,45 @@ def test_step():
     ) == [1, 4]
 
 
+def test_fused():
+    assert (
+        iw(range(20))
+        .skip(2)
+        .step(3)
+        .map(lambda x: x * 2)
+        .take(4)
+        .filter(lambda x: x > 10)
+        .collect(list)
+    ) == [16, 22]
+
+    # take() does not pull more than it yields
+    src = iter(range(10))
+    assert iw(src).skip(1).take(2).collect(list) == [1, 2]
+    assert next(src) == 3
+
+
+def test_noop():
+    i = iw([1, 2])
+    assert i.repeat(1) is i
+    assert i.chain([]) is i
+    assert i.skip(0) is i
+    assert i.step(1) is i
+    assert i.repeat(0).collect(list) == []
+    assert i.take(0).collect(list) == []
+
+
+def test_count_args():
+    assert iw(range(5)).take(2.0).collect(list) == [0, 1]
+    assert iw(range(5)).step(2.0).collect(list) == [0, 2, 4]
+
+    with pytest.raises(ValueError):
+        iw(range(5)).skip(-1)
+    with pytest.raises(ValueError):
+        iw(range(5)).step(0)
+    with pytest.raises(TypeError):
+        iw(range(5)).take(1.5)
+
+
 def test_mutate():
     assert (
         iw([1, 2, 3, 4])
@@ -85,6 +156,21 @@ def test_repeat():
         .collect(list)
     ) == [1, 2, 1, 2, 1, 2]
 
+    # one-shot sources are cached instead of yielding once
+    assert (
+        iw(x for x in [1, 2])
+        .repeat(2)
+        .collect(list)
+    ) == [1, 2, 1, 2]
+
+    # the first round is yielded while it is cached
+    assert (
+        iw(itertools.count())
+        .repeat(2)
+        .take(3)
+        .collect(list)
+    ) == [0, 1, 2]
+
 
 def test_chunk():
     assert (
@@ -127,6 +213,19 @@ def test_fold():
     ) == 30
 
 
+def test_fold_njit():
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("numba")
+
+    assert (
+        iw(np.arange(1, 5))
+        .fold_njit(lambda c, x: c + x ** 2, d=0)
+    ) == 30
+
+    with pytest.raises(TypeError):
+        iw([1, 2]).fold_njit(lambda c, x: c + x)
+
+
 def test_unwrap():
     assert (
         iw([1, 2, 3, 4])
@@ -196,10 +295,50 @@ def test_count():
              .filter(lambda x: x % 2 == 0)
              .collect(list))
 
+    assert iw(range(10 ** 12)).count() == 10 ** 12
+    assert iw(range(10)).filter(lambda x: x % 2 == 0).count() == 5
+
 
 def test_contains():
     assert iw([1, 2, 3]).contains(1)
     assert not iw([1, 2, 3]).contains(4)
+    assert iw(range(10 ** 12)).contains(10 ** 12 - 1)
+    assert not iw({1, 2}).contains([1])
+
+
+def test_materialize():
+    i = iw(x for x in range(3)).map(str).materialize()
+    assert i.count() == 3
+    assert i.collect(''.join) == '012'
+
+    # re-iterable containers are kept as they are
+    assert iw({1: 'a'}).materialize()[1] == 'a'
+    assert isinstance(iw({1, 2}).materialize().unwrap(), set)
+
+    i = iw(x for x in range(3)).cached()
+    assert i.take(2).collect(list) == [0, 1]
+    assert i.collect(list) == [0, 1, 2]
+    assert 2 in i and i.count() == 3
+
+    # only a directly wrapped one-shot iterator warns, at the caller
+    with pytest.warns(UserWarning) as record:
+        1 in iw(x for x in range(3))
+    assert record[0].filename == __file__
+    with pytest.warns(UserWarning) as record:
+        iw(x for x in range(3)).contains(1)
+    assert record[0].filename == __file__
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert iw(range(10)).filter(lambda x: x % 2 == 0).count() == 5
+        assert 2 in iw(range(10)).filter(lambda x: x % 2 == 0)
+        assert iw(x for x in range(3)).count() == 3
+        assert 1 in iw([1, 2]).foreach(lambda x: x)
+        assert 1 in iw([1, 2]).chain([3])
+        assert 1 in iw([[1], [2]]).flat()
+        i = iw([1, 2]).map(int)
+        i.unwrap()
+        assert 1 in i
 
 
 def test_rev():
@@ -250,6 +389,24 @@ def test_override():
     # len
     assert len(iw([1, 2])) == len([1, 2])
 
+    # bool
+    assert iw([1])
+    assert not iw([])
+    assert iw(range(3)).map(str)
+    assert iw(x for x in ())
+
+    # nested wrappers
+    assert iw(iw(x for x in range(3))).count() == 3
+    assert iw(iw(x for x in range(3)))
+    assert iw(x for x in range(3)).mutate(iw).count() == 3
+    assert len(iw(iw([1, 2]))) == 2
+    assert not iw(iw([]))
+
+    # list() must not drain a lazy wrapper through len()
+    assert list(iw(x for x in range(3))) == [0, 1, 2]
+    assert list(iw([1, 2]).map(str)) == ['1', '2']
+    assert iw(range(10)).map(str).step(3).__length_hint__() == 4
+
     # | (pipe) -> map
     assert (iw([1, 2]) | str | ord).collect(list) == [49, 50]
 
@@ -260,11 +417,17 @@ def test_override():
     assert iw([1, 2])[1] == 2
     assert iw({5: 6})[5] == 6
     assert iw(range(6))[2] == 2
+    assert iw(x for x in range(6))[2] == 2
+    with pytest.raises(IndexError):
+        iw(x for x in range(6))[6]
 
     # slicing
     assert iw(range(10))[::3].collect(list) == [0, 3, 6, 9]
     assert iw(range(10))[5::].collect(list) == [5, 6, 7, 8, 9]
     assert iw(range(10))[:5:].collect(list) == [0, 1, 2, 3, 4]
+    assert iw({x: x for x in range(10)})[1:2:3].collect(list) == [1, 4]
+    assert iw({x: x for x in range(10)})[8:].collect(list) == [8, 9]
+    assert iw(deque(range(10)))[2:5:1].collect(list) == [2, 3, 4, 5, 6]
 
     # most types supports slicing so...
     assert iw(range(10)).take(10)[2:2:2].collect(list) == [2, 4]